@@ -1,13 +1,21 @@
 import streamlit as st
-import json
+import orjson
 import pandas as pd
 import os
 from datetime import datetime
 import plotly.graph_objects as go
 import time
-from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from functools import lru_cache
+import asyncio
+import atexit
+import threading
+import tempfile
+import logging
 from offline_chatbot import NewsenseClient, chatbot, analyze_data
-import difflib
+from rapidfuzz import process, fuzz
+
+logger = logging.getLogger(__name__)
 
 # --- PAGE CONFIGURATION ---
 st.set_page_config(
@@ -33,6 +41,30 @@ def get_cached_device_map(_client):
     except:
         return {}
 
+@st.cache_resource
+def bootstrap_backend(base_url, user, password):
+    """(client, device_map, resolver), built once per set of credentials."""
+    client = get_newsense_client(base_url, user, password)
+    if client is None:
+        return None
+    dev_map = get_cached_device_map(client)
+    return client, dev_map, make_device_resolver(dev_map)
+
+def make_device_resolver(dev_map):
+    """Map a KG device name to its Newsense id, falling back to a fuzzy match."""
+    dev_keys = list(dev_map.keys())
+
+    @lru_cache(maxsize=512)
+    def resolve(d_name):
+        if not d_name: return None
+        d_id = dev_map.get(d_name)
+        if d_id is None:
+            match = process.extractOne(d_name, dev_keys, scorer=fuzz.ratio, score_cutoff=70)
+            d_id = dev_map[match[0]] if match else None
+        return d_id
+
+    return resolve
+
 # --- INITIALIZE SESSION STATE ---
 if 'chat_history' not in st.session_state: st.session_state.chat_history = []
 if 'all_chat_history' not in st.session_state: st.session_state.all_chat_history = []
@@ -40,103 +72,284 @@ if 'kg_df' not in st.session_state: st.session_state.kg_df = pd.DataFrame()
 if 'active_page' not in st.session_state: st.session_state.active_page = "💬 Chatbot"
 
 # --- HELPER FUNCTIONS ---
+def kg_parquet_path(path):
+    return os.path.splitext(path)[0] + ".parquet"
+
+@st.cache_data(ttl=3600, show_spinner=False)
+def _read_knowledge_graph(path, use_parquet, mtime):
+    # mtime is part of the cache key so a saved KG is picked up immediately
+    if use_parquet:
+        return pd.read_parquet(kg_parquet_path(path))
+    df = pd.read_excel(path, engine="calamine")
+    try:
+        df.to_parquet(kg_parquet_path(path), index=False)
+    except Exception:
+        pass  # Mixed-type columns can't always be written; keep reading the .xlsx
+    return df
+
 def load_knowledge_graph(path):
-    if os.path.exists(path):
-        return pd.read_excel(path)
-    return pd.DataFrame()
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    parquet_path = kg_parquet_path(path)
+    if os.path.exists(parquet_path) and os.path.getmtime(parquet_path) >= os.path.getmtime(path):
+        return _read_knowledge_graph(path, True, os.path.getmtime(parquet_path))
+    return _read_knowledge_graph(path, False, os.path.getmtime(path))
+
+# Shared by the writer's timer thread and every session's History page
+_migration_lock = threading.Lock()
+
+def migrate_legacy_history(json_path):
+    """Convert a legacy history_YYYY-MM-DD.json array into .jsonl, once."""
+    jsonl_path = json_path + "l"
+    if os.path.exists(jsonl_path) or not os.path.exists(json_path):
+        return jsonl_path
+    with _migration_lock:
+        # Someone may have migrated (and appended to) it while we waited
+        if os.path.exists(jsonl_path):
+            return jsonl_path
+        with open(json_path, 'rb') as f:
+            daily_history = orjson.loads(f.read())
+        with tempfile.NamedTemporaryFile(dir=os.path.dirname(jsonl_path) or ".", suffix=".tmp", delete=False) as f:
+            tmp_path = f.name
+            f.write(b"".join(orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE) for entry in daily_history))
+        try:
+            os.replace(tmp_path, jsonl_path)
+        except OSError:
+            os.remove(tmp_path)
+            raise
+    return jsonl_path
+
+def iter_history_file(file_path):
+    with open(file_path, 'rb') as f:
+        for line in f:
+            if not line.strip(): continue
+            try:
+                yield orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Partial trailing line from an interrupted write
+                continue
+
+class HistoryWriter:
+    """Buffers history entries and appends them to the daily JSONL files in batches."""
+
+    def __init__(self, history_dir="chat_history", delay=2.0, max_pending=10):
+        self.history_dir = history_dir
+        self.delay = delay
+        self.max_pending = max_pending
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        # Last flush failure, surfaced to the UI; the failed lines are kept in _pending for a retry
+        self.last_error = None
+        atexit.register(self.flush)
+
+    def add(self, entry):
+        # Serialise now so bad entries fail in the caller, not in the timer thread
+        date_str = datetime.fromisoformat(entry['timestamp']).strftime("%Y-%m-%d")
+        json_path = os.path.join(self.history_dir, f"history_{date_str}.json")
+        line = orjson.dumps(entry, option=orjson.OPT_APPEND_NEWLINE)
+        with self._lock:
+            self._pending.append((json_path, line))
+            if len(self._pending) < self.max_pending:
+                if self._timer is None:
+                    self._timer = threading.Timer(self.delay, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if not batch:
+            return
+        by_file = {}
+        for json_path, line in batch:
+            by_file.setdefault(json_path, []).append(line)
+        failed, error = [], None
+        with self._write_lock:
+            for json_path, lines in by_file.items():
+                try:
+                    os.makedirs(self.history_dir, exist_ok=True)
+                    self._append(migrate_legacy_history(json_path), b"".join(lines))
+                except Exception as e:
+                    failed.extend((json_path, line) for line in lines)
+                    error = e
+        if failed:
+            logger.error("History flush failed, %d entries kept for retry: %s", len(failed), error)
+            with self._lock:
+                # Keep them ahead of anything added meanwhile; the next add()/flush() retries
+                self._pending[:0] = failed
+                self.last_error = error
+        else:
+            self.last_error = None
+
+    @staticmethod
+    def _append(file_path, data):
+        with open(file_path, 'a+b') as f:
+            if f.seek(0, os.SEEK_END):
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    # A crash mid-write left a partial last line; don't glue this batch onto it
+                    data = b"\n" + data
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+@st.cache_resource
+def get_history_writer():
+    return HistoryWriter()
 
 def save_chat_history_by_date(entry):
+    writer = get_history_writer()
     try:
-        history_dir = "chat_history"
-        if not os.path.exists(history_dir): os.makedirs(history_dir)
-        date_str = datetime.fromisoformat(entry['timestamp']).strftime("%Y-%m-%d")
-        file_path = os.path.join(history_dir, f"history_{date_str}.json")
-        
-        daily_history = []
-        if os.path.exists(file_path):
-            with open(file_path, 'r', encoding='utf-8') as f:
-                daily_history = json.load(f)
-        
-        daily_history.append(entry)
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(daily_history, f, ensure_ascii=False, indent=2)
+        writer.add(entry)
     except Exception as e:
         st.error(f"Save error: {e}")
+    if writer.last_error:
+        st.warning(f"History not saved yet, will retry: {writer.last_error}")
 
-def load_all_history():
-    all_history = []
+def iter_all_history():
+    """Yield history entries newest first."""
     history_dir = "chat_history"
-    if os.path.exists(history_dir):
-        for filename in os.listdir(history_dir):
-            if filename.endswith(".json"):
-                with open(os.path.join(history_dir, filename), 'r', encoding='utf-8') as f:
-                    all_history.extend(json.load(f))
-    return sorted(all_history, key=lambda x: x.get('timestamp', ''), reverse=True)
+    if not os.path.exists(history_dir):
+        return
+    for filename in os.listdir(history_dir):
+        if filename.endswith(".json"):
+            migrate_legacy_history(os.path.join(history_dir, filename))
+    # history_YYYY-MM-DD.jsonl names sort by date
+    for filename in sorted(os.listdir(history_dir), reverse=True):
+        if not filename.endswith(".jsonl"): continue
+        # Lines within a day are chronological
+        yield from reversed(list(iter_history_file(os.path.join(history_dir, filename))))
+
+def history_signature():
+    """Changes when a day file is created or today's file is appended to."""
+    history_dir = "chat_history"
+    if not os.path.exists(history_dir):
+        return None
+    today_path = os.path.join(history_dir, f"history_{datetime.now().strftime('%Y-%m-%d')}.jsonl")
+    today_mtime = os.path.getmtime(today_path) if os.path.exists(today_path) else 0
+    return os.path.getmtime(history_dir), today_mtime
+
+@st.cache_resource(ttl=60, show_spinner=False)
+def _load_all_history(signature):
+    # One shared newest-first list; callers only read it
+    return list(iter_all_history())
+
+async def _fetch_data_async(client, resolve, devices, start, end):
+    # Group variables by device id so each device costs one request
+    device_groups = {}
+    for idx, info in enumerate(devices):
+        d_id = resolve(info.get("Device"))
+        if d_id and info.get("Tên biến"):
+            if d_id not in device_groups:
+                device_groups[d_id] = []
+            device_groups[d_id].append((idx, info))
+
+    async with client.async_session() as http:
+        async def fetch_device(d_id, items):
+            try:
+                frames = await client.aget_timeseries_multi(http, d_id, [info["Tên biến"] for _, info in items], start, end)
+            except:
+                return []
+            found = []
+            for idx, info in items:
+                d_name = info.get("Device")
+                v_name = info["Tên biến"]
+                df = frames.get(v_name)
+                if df is not None and not df.empty:
+                    found.append((idx, {"label": f"{info.get('Tên thiết bị', d_name)} ({v_name})", "data": df, "v": v_name,
+                                        "latest": df.attrs.get("latest")}))
+            return found
+
+        responses = await asyncio.gather(*(fetch_device(d_id, items) for d_id, items in device_groups.items()),
+                                         return_exceptions=True)
+    # Restore the order the devices were requested in
+    found = sorted((pair for res in responses if not isinstance(res, BaseException) for pair in res),
+                   key=lambda pair: pair[0])
+    return [item for _, item in found]
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _cached_data(_client, _resolve, devices, start, end):
+    return asyncio.run(_fetch_data_async(_client, _resolve, devices, start, end))
 
 def fetch_data_parallel(devices, start, end):
     client = st.session_state.newsense_client
-    dev_map = st.session_state.device_map
+    resolve = st.session_state.device_resolver
+    return _cached_data(client, resolve, devices, start, end)
 
-    def fetch_single(info):
-        d_name = info.get("Device")
-        v_name = info.get("Tên biến")
-        d_id = dev_map.get(d_name) or dev_map.get(difflib.get_close_matches(d_name, dev_map.keys(), n=1, cutoff=0.7)[0] if difflib.get_close_matches(d_name, dev_map.keys()) else None)
-        if d_id:
+async def _fetch_status_async(client, device_groups):
+    async with client.async_session() as http:
+        async def fetch_single(d_id, d_info):
             try:
-                df = client.get_timeseries(d_id, v_name, start, end)
-                if not df.empty:
-                    return {"label": f"{info.get('Tên thiết bị', d_name)} ({v_name})", "data": df, "v": v_name}
-            except: pass
-        return None
+                return await client.aget_latest_telemetry(http, d_id, d_info["name"], d_info["keys"])
+            except:
+                return []
 
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        return [r for r in list(executor.map(fetch_single, devices)) if r]
+        responses = await asyncio.gather(*(fetch_single(d_id, d_info) for d_id, d_info in device_groups.items()),
+                                         return_exceptions=True)
+    results = []
+    for res in responses:
+        if res and not isinstance(res, BaseException):
+            results.extend(res)
+    return results
 
 def fetch_status_parallel(devices):
     client = st.session_state.newsense_client
-    dev_map = st.session_state.device_map
+    resolve = st.session_state.device_resolver
 
     # Group variables by device id
     device_groups = {}
     for info in devices:
         d_name = info.get("Device")
         v_name = info.get("Tên biến")
-        d_id = dev_map.get(d_name) or dev_map.get(difflib.get_close_matches(d_name, dev_map.keys(), n=1, cutoff=0.7)[0] if difflib.get_close_matches(d_name, dev_map.keys()) else None)
+        d_id = resolve(d_name)
         if d_id and v_name:
             if d_id not in device_groups:
                 device_groups[d_id] = {"name": d_name, "keys": []}
             device_groups[d_id]["keys"].append(v_name)
 
-    def fetch_single(args):
-        d_id, d_info = args
-        try:
-            return client.get_latest_telemetry(d_id, d_info["name"], d_info["keys"])
-        except:
-            return []
+    return asyncio.run(_fetch_status_async(client, device_groups))
 
-    results = []
-    with ThreadPoolExecutor(max_workers=5) as executor:
-        for res in executor.map(fetch_single, device_groups.items()):
-            if res:
-                results.extend(res)
-    return results
+@st.cache_resource(ttl=300, max_entries=64, show_spinner=False)
+def make_figure(x, y, name):
+    # Shared, read-only Figure: plotly_chart serialises it without mutating
+    return go.Figure(go.Scatter(x=x, y=y, name=name))
 
 # --- UI PAGES ---
-def chatbot_interaction_page():
-    st.title("💬 Chatbot Interaction")
-    st.divider()
+# Chat replay, the chart block and the side pages are fragments: their widgets rerun only themselves.
+# st.chat_input stays at the top level so it is pinned to the bottom of the page.
+@st.fragment
+def render_charts(i, data, query):
+    if st.toggle("Show Charts", value=True, key=f"tgl_{i}"):
+        for idx, item in enumerate(data):
+            fig = make_figure(item['data']['ts'], item['data']['value'], item['label'])
+            st.plotly_chart(fig, use_container_width=True, key=f"ch_{i}_{idx}")
 
+        if st.button("🔍 Analysis", key=f"an_btn_{i}"):
+            with st.spinner("Analyzing..."):
+                st.info(analyze_data(data, query))
+
+@st.fragment
+def render_chat_history():
+    last = len(st.session_state.chat_history) - 1
     for i, msg in enumerate(st.session_state.chat_history):
         with st.chat_message(msg['role']):
             if msg['role'] == 'user':
                 st.write(msg['content'])
             else:
                 try:
-                    res = json.loads(msg['content'])
+                    res = msg.get('parsed') or orjson.loads(msg['content'])
                     st.json(res)
                     devices = res.get("devices", [])
                     intent = res.get("intent", "chart")
-                    if devices:
+                    # Only the latest answer re-queries Newsense on rerun
+                    if devices and i == last:
                         if intent == "check_status":
                             status_data = fetch_status_parallel(devices)
                             if status_data:
@@ -150,19 +363,16 @@ def chatbot_interaction_page():
                                 if res.get("is_latest"):
                                     cols = st.columns(len(data))
                                     for j, item in enumerate(data):
-                                        latest = item['data'].iloc[-1]
-                                        cols[j].metric(item['label'], f"{latest['value']:.2f}")
+                                        cols[j].metric(item['label'], f"{item['latest']:.2f}")
                                 
-                                if st.toggle("Show Charts", value=True, key=f"tgl_{i}"):
-                                    for idx, item in enumerate(data):
-                                        fig = go.Figure(go.Scatter(x=item['data']['ts'], y=item['data']['value'], name=item['label']))
-                                        st.plotly_chart(fig, use_container_width=True, key=f"ch_{i}_{idx}")
-                                    
-                                    if st.button("🔍 Analysis", key=f"an_btn_{i}"):
-                                        with st.spinner("Analyzing..."):
-                                            st.info(analyze_data(data, st.session_state.chat_history[i-1]['content']))
+                                render_charts(i, data, st.session_state.chat_history[i-1]['content'])
                 except: st.write(msg['content'])
 
+def chatbot_interaction_page():
+    st.title("💬 Chatbot Interaction")
+    st.divider()
+    render_chat_history()
+
     if prompt := st.chat_input("Hỏi tôi về dữ liệu thiết bị..."):
         st.session_state.chat_history.append({"role": "user", "content": prompt})
         with st.spinner("Đang phân tích query..."):
@@ -172,20 +382,27 @@ def chatbot_interaction_page():
                 save_chat_history_by_date({"timestamp": datetime.now().isoformat(), "query": prompt, "response": result})
         st.rerun()
 
+@st.fragment
 def history_page():
     st.title("📜 Chat History")
-    history = load_all_history()
+    search = st.text_input("🔍 Search queries...")
+    writer = get_history_writer()
+    writer.flush()
+    if writer.last_error:
+        st.warning(f"History not saved yet, will retry: {writer.last_error}")
+    needle = search.lower()
+    entries = _load_all_history(history_signature())
+    history = list(islice((e for e in entries if needle in e.get('query', '').lower()), 200))
     if not history:
         st.info("No history found.")
         return
-    
-    search = st.text_input("🔍 Search queries...")
+
     for entry in history:
-        if search.lower() in entry['query'].lower():
-            with st.expander(f"🕒 {entry['timestamp'][:16]} | {entry['query'][:50]}..."):
-                st.write(f"**Query:** {entry['query']}")
-                st.json(entry['response'])
+        with st.expander(f"🕒 {entry['timestamp'][:16]} | {entry['query'][:50]}..."):
+            st.write(f"**Query:** {entry['query']}")
+            st.json(entry['response'])
 
+@st.fragment
 def kg_editor_page(config):
     st.title("📊 Knowledge Graph Editor")
     if st.session_state.kg_df.empty:
@@ -194,6 +411,10 @@ def kg_editor_page(config):
     edited_df = st.data_editor(st.session_state.kg_df, num_rows="dynamic", use_container_width=True)
     if st.button("💾 Save Knowledge Graph"):
         edited_df.to_excel(config['knowledge_graph']['path'], index=False)
+        try:
+            edited_df.to_parquet(kg_parquet_path(config['knowledge_graph']['path']), index=False)
+        except Exception:
+            pass  # Older .parquet stays stale and is ignored in favour of the newer .xlsx
         st.session_state.kg_df = edited_df
         st.success("Saved!")
 
@@ -205,7 +426,7 @@ def main():
     }
     # In real use, load from your config.json
     try:
-        with open('config.json', 'r') as f: config = json.load(f)
+        with open('config.json', 'rb') as f: config = orjson.loads(f.read())
     except: pass
 
     # Ensure Knowledge Graph is loaded
@@ -213,12 +434,13 @@ def main():
         st.session_state.kg_df = load_knowledge_graph(config['knowledge_graph']['path'])
 
     # Initialization
-    client = get_newsense_client(config['api']['base_url'], config['api']['tb_user'], config['api']['tb_pass'])
+    backend = bootstrap_backend(config['api']['base_url'], config['api']['tb_user'], config['api']['tb_pass'])
     m_name = "Offline Engine"
     
-    if client:
-        st.session_state.newsense_client = client
-        st.session_state.device_map = get_cached_device_map(client)
+    if backend:
+        (st.session_state.newsense_client,
+         st.session_state.device_map,
+         st.session_state.device_resolver) = backend
     else:
         st.error("Client failed to initialize. Check config.json")
         return
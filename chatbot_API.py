@@ -3,25 +3,48 @@ Core chatbot functionality extracted from ai_chatbot.py
 """
 import os
 import re
+import asyncio
 import json
+import orjson
 import requests
 import pandas as pd
 import numpy as np
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from functools import lru_cache
 import difflib
 import google.generativeai as genai
+from google.generativeai import caching
 
 
 # ===============================================================
 # 🛑 NEWSENSE CLIENT
 # ===============================================================
+def _parse_json(content):
+    """orjson.loads, falling back to stdlib json for payloads with NaN/Infinity literals."""
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return json.loads(content)
+
+
+def _as_float(value):
+    """float(value), or NaN for missing/non-numeric telemetry values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+
 class NewsenseClient:
     def __init__(self, base_url, username, password):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
         self.session = requests.Session()
+        self.session.headers.update({"Accept-Encoding": "gzip, deflate"})
         self.token = self.login()
+        # Set the auth header once instead of rebuilding it for every call
+        self.session.headers["X-Authorization"] = f"Bearer {self.token}"
 
     def login(self):
         url = f"{self.base_url}/auth/login"
@@ -29,16 +52,15 @@ class NewsenseClient:
         if resp.status_code == 401:
             raise Exception("❌ Sai username hoặc mật khẩu.")
         resp.raise_for_status()
-        return resp.json().get("token")
+        return orjson.loads(resp.content).get("token")
 
     def get_devices(self):
-        headers = {"X-Authorization": f"Bearer {self.token}"}
         page = 0
         devices = []
         while True:
-            resp = self.session.get(f"{self.base_url}/tenant/devices", headers=headers, params={"pageSize": 100, "page": page})
+            resp = self.session.get(f"{self.base_url}/tenant/devices", params={"pageSize": 100, "page": page})
             resp.raise_for_status()
-            data = resp.json()
+            data = _parse_json(resp.content)
             for d in data.get("data", []):
                 devices.append({"id": d["id"]["id"], "name": d["name"]})
             if not data.get("hasNextPage"):
@@ -47,11 +69,10 @@ class NewsenseClient:
         return devices
 
     def get_keys(self, device_id):
-        headers = {"X-Authorization": f"Bearer {self.token}"}
         url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/keys/timeseries"
-        resp = self.session.get(url, headers=headers)
+        resp = self.session.get(url)
         if resp.status_code == 200:
-            return [k for k in resp.json() if k != 'timestamp']
+            return [k for k in _parse_json(resp.content) if k != 'timestamp']
         else:
             return []
     
@@ -76,7 +97,6 @@ class NewsenseClient:
             return False, f"Variable '{variable_name}' not found for device '{device_name}'. Available variables: {', '.join(available_keys[:10])}"
 
     def get_timeseries(self, device_id, key, start_date_str, end_date_str):
-        headers = {"X-Authorization": f"Bearer {self.token}"}
         url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
 
         try:
@@ -115,48 +135,68 @@ class NewsenseClient:
         else:
             params["limit"] = 10000
 
-        resp = self.session.get(url, headers=headers, params=params)
+        resp = self.session.get(url, params=params)
 
         if resp.status_code != 200:
             return pd.DataFrame()
 
-        data = resp.json().get(key, [])
+        data = _parse_json(resp.content).get(key, [])
         if not data:
             return pd.DataFrame()
 
-        df = pd.DataFrame(data)
-        df["ts"] = pd.to_datetime(df["ts"], unit="ms")
-        df["value"] = pd.to_numeric(df["value"], errors="coerce")
-        df = df.dropna(subset=['value'])
-        return df[["ts", "value"]]
+        ts = np.fromiter((d["ts"] for d in data), dtype=np.int64, count=len(data))
+        val = np.fromiter((_as_float(d.get("value")) for d in data), dtype=np.float64, count=len(data))
+        mask = ~np.isnan(val)
+        return pd.DataFrame({"ts": pd.to_datetime(ts[mask], unit="ms"), "value": val[mask]})
 
 
 # ===============================================================
 # 🕓 INTERPRET RELATIVE TIME
 # ===============================================================
+_REL_PAT = re.compile(r"(\d+)\s*(ngày|tuần|tháng|năm)")
+_KEYWORDS = re.compile(r"(hôm nay|hôm qua|tuần này|tháng này|từ đầu năm|năm ngoái)")
+_LATEST = re.compile(r"mới nhất|hiện tại|giá trị bao nhiêu|lần cuối|is what value")
+
+# keyword -> now -> (start, end), in the order the keywords are checked
+_KEYWORD_RANGES = {
+    "hôm nay":    lambda now: (now, now),
+    "hôm qua":    lambda now: (now - timedelta(days=1), now - timedelta(days=1)),
+    "tuần này":   lambda now: (now - timedelta(days=now.weekday()), now),
+    "tháng này":  lambda now: (now.replace(day=1), now),
+    "từ đầu năm": lambda now: (now.replace(day=1, month=1), now),
+    "năm ngoái":  lambda now: (datetime(now.year - 1, 1, 1), datetime(now.year - 1, 12, 31)),
+}
+# These win over an "N ngày/tuần/tháng/năm" phrase; the other keywords don't
+_PRIORITY_KEYWORDS = ("hôm nay", "hôm qua")
+
+
 def interpret_relative_time(query: str):
     """
     Enhanced version to handle 'ngày', 'tuần', 'tháng', 'năm' and 'mới nhất/hiện tại'.
     Returns (start_date, end_date, is_latest_requested)
     """
-    now = datetime.now()
-    text = query.lower()
+    return _interpret_rt(query.lower(), date.today())
+
+
+@lru_cache(maxsize=512)
+def _interpret_rt(text: str, today: date):
+    # Output is date-only, so keying on today keeps the cache correct across midnight
+    now = datetime.combine(today, datetime.min.time())
     start = None
     end = now
     
     # Detect if user is asking for the latest/current values
-    is_latest = any(word in text for word in ["mới nhất", "hiện tại", "giá trị bao nhiêu", "lần cuối", "is what value"])
-
-    if "hôm nay" in text:
-        start = now.replace(hour=0, minute=0, second=0)
-        return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), is_latest
-
-    if "hôm qua" in text:
-        start = (now - timedelta(days=1)).replace(hour=0, minute=0, second=0)
-        end = (now - timedelta(days=1)).replace(hour=23, minute=59, second=59)
+    is_latest = bool(_LATEST.search(text))
+
+    kw = None
+    if _KEYWORDS.search(text):
+        # Several keywords may appear; the first in check order wins, not the leftmost in the text
+        kw = next(k for k in _KEYWORD_RANGES if k in text)
+    if kw in _PRIORITY_KEYWORDS:
+        start, end = _KEYWORD_RANGES[kw](now)
         return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), is_latest
 
-    m = re.search(r"(\d+)\s*(ngày|tuần|tháng|năm)", text)
+    m = _REL_PAT.search(text)
     if m:
         n = int(m.group(1))
         unit = m.group(2)
@@ -173,22 +213,10 @@ def interpret_relative_time(query: str):
         if start:
             return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), is_latest
 
-    if "tuần này" in text:
-        start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0)
-        return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), is_latest
-
-    if "tháng này" in text:
-        start = now.replace(day=1, hour=0, minute=0, second=0)
-        return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), is_latest
-
-    if "từ đầu năm" in text:
-        start = now.replace(day=1, month=1, hour=0, minute=0, second=0)
+    if kw:
+        start, end = _KEYWORD_RANGES[kw](now)
         return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d"), is_latest
 
-    if "năm ngoái" in text:
-        y = now.year - 1
-        return f"{y}-01-01", f"{y}-12-31", is_latest
-
     # If asking for latest but no specific date context, look at last 24h
     if is_latest:
         start = now - timedelta(days=1)
@@ -219,43 +247,143 @@ Lưu ý: "is_latest": true nếu người dùng hỏi giá trị hiện tại/m
 
 
 
-def chatbot(query: str, kg_df: pd.DataFrame, chat_history: list, gemini_model):
-    # Optimize KG representation once and reuse if possible (or just keep it lean here)
-    compact_kg = kg_df[["Tên thiết bị", "Device", "Tên biến", "Vị trí", "Loại thiết bị"]].to_dict(orient="records")
-    
-    # Compress history significantly (last 3 turns only) for speed
-    history_context = chat_history[-6:] if len(chat_history) > 6 else chat_history
-    history_text = "\n".join([f"{m['role']}: {m['content']}" for m in history_context])
-    
-    # Pre-calculate time context to guide model and reduce its workload
-    rel_start, rel_end, is_latest = interpret_relative_time(query)
-    time_hint = f"Requested: {rel_start} to {rel_end}, Latest: {is_latest}" if rel_start else ""
-
-    system_msg = f"{SYSTEM_PROMPT}\nKG:\n{json.dumps(compact_kg, ensure_ascii=False)}\nTimeHint: {time_hint}"
-    full_prompt = f"{system_msg}\n\nhistory:\n{history_text}\n\nUser: {query}\nJSON:"
+def _dumps(obj) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def _dumps_indent(obj) -> str:
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SERIALIZE_NUMPY).decode()
+
+
+def _norm_date(s):
+    """Normalize a model-supplied date to YYYY-MM-DD, or None if unparseable."""
+    if not s: return None
+    try: return date.fromisoformat(s).isoformat()
+    except TypeError: return None
+    except ValueError: pass
+    # strptime still takes unpadded ISO dates like 2024-1-9, which fromisoformat rejects on <= 3.10
+    for f in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
+        try: return datetime.strptime(s, f).strftime("%Y-%m-%d")
+        except ValueError: continue
+    return None
+
+
+def _strip_fences(s: str) -> str:
+    """Drop a leading ```json (or ```) line and a trailing ``` from a model reply."""
+    s = s.strip()
+    if s.startswith("```"):
+        s = s.split("\n", 1)[1] if "\n" in s else s[3:]
+        if s.endswith("```"): s = s[:-3]
+    return s.strip()
+
+
+def _extract_json(s: str, open_ch: str = "{", close_ch: str = "}"):
+    """First balanced {...} block in s (or [...] with open_ch="["), skipping brackets inside strings; None if it never closes."""
+    start = s.find(open_ch)
+    if start < 0:
+        return None
+    depth, in_str, escaped = 0, False, False
+    for i in range(start, len(s)):
+        c = s[i]
+        if in_str:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_str = False
+        elif c == '"':
+            in_str = True
+        elif c == open_ch:
+            depth += 1
+        elif c == close_ch:
+            depth -= 1
+            if depth == 0:
+                return s[start:i + 1]
+    return None
+
+
+KG_COLUMNS = ["Tên thiết bị", "Device", "Tên biến", "Vị trí", "Loại thiết bị"]
+KG_CACHE_TTL = timedelta(hours=1)
+
+# (model_name, kg_hash) -> (model bound to the cached prefix or None, valid_until)
+_kg_caches = {}
+# kg_hash -> serialized KG, for the last few KG versions
+_kg_json_cache = {}
+_KG_JSON_CACHE_SIZE = 4
+
+
+def _kg_hash(kg_df: pd.DataFrame) -> int:
+    # Recomputed every call: it is the key that notices in-place KG edits
+    return int(pd.util.hash_pandas_object(kg_df[KG_COLUMNS], index=False).sum())
+
+
+def _kg_json(kg_df: pd.DataFrame, kg_hash: int = None) -> str:
+    """Compact JSON dump of the KG columns, reused while the KG content is unchanged."""
+    if kg_hash is None:
+        kg_hash = _kg_hash(kg_df)
+    kg_json = _kg_json_cache.get(kg_hash)
+    if kg_json is None:
+        compact_kg = kg_df[KG_COLUMNS].to_dict(orient="records")
+        kg_json = orjson.dumps(compact_kg, default=str).decode()
+        if len(_kg_json_cache) >= _KG_JSON_CACHE_SIZE:
+            _kg_json_cache.pop(next(iter(_kg_json_cache)))
+        _kg_json_cache[kg_hash] = kg_json
+    return kg_json
+
+
+def get_or_create_kg_cache(kg_df: pd.DataFrame, gemini_model, kg_hash: int = None):
+    """
+    Return a model bound to a Gemini context cache holding SYSTEM_PROMPT + KG,
+    or None if explicit caching isn't available for this model/prefix.
+    """
+    if kg_hash is None:
+        kg_hash = _kg_hash(kg_df)
+    key = (gemini_model.model_name, kg_hash)
+    hit = _kg_caches.get(key)
+    if hit and hit[1] > datetime.now():
+        return hit[0]
 
-    # Aggressive generation config for speed
-    gen_config = genai.HistoryConfig(
-        # Use simple generation config
-    )
-    
-    response = gemini_model.generate_content(
-        full_prompt,
-        generation_config=genai.GenerationConfig(
-            temperature=0.0,
-            max_output_tokens=800  # JSON for extraction is small
+    try:
+        cache = caching.CachedContent.create(
+            model=gemini_model.model_name,
+            system_instruction=SYSTEM_PROMPT,
+            contents=[f"KG:\n{_kg_json(kg_df, kg_hash)}"],
+            ttl=KG_CACHE_TTL,
         )
-    )
-    
-    content = response.text.strip().replace("```json", "").replace("```", "").strip()
+        cached_model = genai.GenerativeModel.from_cached_content(cached_content=cache)
+    except Exception:
+        # e.g. prefix below the model's minimum cacheable size: don't retry every turn
+        cached_model = None
+
+    # Renew a little before the server-side TTL runs out
+    _kg_caches[key] = (cached_model, datetime.now() + KG_CACHE_TTL - timedelta(minutes=5))
+    return cached_model
+
+
+def _kg_model(kg_df: pd.DataFrame, gemini_model):
+    """(model, prompt prefix): the context-cached model and no prefix, or the plain model with SYSTEM_PROMPT + KG inline."""
+    kg_hash = _kg_hash(kg_df)
+    cached_model = get_or_create_kg_cache(kg_df, gemini_model, kg_hash)
+    if cached_model:
+        return cached_model, ""
+    return gemini_model, f"{SYSTEM_PROMPT}\nKG:\n{_kg_json(kg_df, kg_hash)}"
 
-    try:
-        result = json.loads(content)
-    except:
-        m = re.search(r"(\{.*\})", content, re.DOTALL)
-        if m: result = json.loads(m.group(1))
-        else: return None, chat_history
 
+def _build_prompt(query: str, chat_history: list, prefix: str, rel_start, rel_end, is_latest) -> str:
+    # Compress history significantly (last 3 turns only) for speed
+    history_text = "\n".join(f"{m['role']}: {m['content']}" for m in chat_history[-6:])
+
+    # Only non-empty sections go in: an empty TimeHint/history is just wasted prompt tokens
+    parts = [prefix] if prefix else []
+    # Pre-calculated time context guides the model and reduces its workload
+    if rel_start: parts.append(f"TimeHint: Requested: {rel_start} to {rel_end}, Latest: {is_latest}")
+    if history_text: parts.append(f"\nhistory:\n{history_text}")
+    parts.append(f"\nUser: {query}\nJSON:")
+    return "\n".join(parts)
+
+
+def _enrich_result(result: dict, rel_start, rel_end, is_latest) -> dict:
     # Meta enrichment
     if is_latest: result['is_latest'] = True
     
@@ -263,49 +391,147 @@ def chatbot(query: str, kg_df: pd.DataFrame, chat_history: list, gemini_model):
         result['start_date'], result['end_date'] = rel_start, rel_end
     else:
         # Fallback normalization logic
-        def norm(s):
-            if not s: return None
-            for f in ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y"):
-                try: return datetime.strptime(s, f).strftime("%Y-%m-%d")
-                except: continue
-            return None
-        result['start_date'], result['end_date'] = norm(result.get('start_date')), norm(result.get('end_date'))
+        result['start_date'], result['end_date'] = _norm_date(result.get('start_date')), _norm_date(result.get('end_date'))
         
         now = datetime.now()
         if not result.get('end_date'): result['end_date'] = now.strftime("%Y-%m-%d")
         if not result.get('start_date'):
             days = 1 if result.get('is_latest') else 30
             result['start_date'] = (now - timedelta(days=days)).strftime("%Y-%m-%d")
+    return result
+
+
+def _finish_chat(text: str, query: str, chat_history: list, rel_start, rel_end, is_latest):
+    """Parse the model reply, enrich it and record the turn. Returns (result, chat_history)."""
+    content = _strip_fences(text)
+
+    try:
+        result = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        snippet = _extract_json(content)
+        if snippet: result = orjson.loads(snippet)
+        else: return None, chat_history
+
+    result = _enrich_result(result, rel_start, rel_end, is_latest)
 
     chat_history.append({"role": "user", "content": query})
-    chat_history.append({"role": "assistant", "content": json.dumps(result, ensure_ascii=False)})
+    chat_history.append({"role": "assistant", "content": _dumps(result)})
     return result, chat_history
 
 
+# JSON for extraction is small; 512 still leaves room for a location with a dozen devices
+_EXTRACT_CONFIG = genai.GenerationConfig(temperature=0.0, max_output_tokens=512)
+# Stream the extraction reply and stop reading as soon as the JSON object closes
+STREAM_EXTRACTION = True
+
+
+def _stream_text(response) -> str:
+    buf = ""
+    for chunk in response:
+        if chunk.parts: buf += chunk.text
+        if _extract_json(buf): break
+    return buf
+
+
+async def _astream_text(response) -> str:
+    buf = ""
+    async for chunk in response:
+        if chunk.parts: buf += chunk.text
+        if _extract_json(buf): break
+    return buf
+
+
+def chatbot(query: str, kg_df: pd.DataFrame, chat_history: list, gemini_model, stream: bool = STREAM_EXTRACTION):
+    rel_start, rel_end, is_latest = interpret_relative_time(query)
+    # SYSTEM_PROMPT + KG are served from the context cache when possible
+    model, prefix = _kg_model(kg_df, gemini_model)
+    full_prompt = _build_prompt(query, chat_history, prefix, rel_start, rel_end, is_latest)
+
+    response = model.generate_content(full_prompt, generation_config=_EXTRACT_CONFIG, stream=stream)
+    text = _stream_text(response) if stream else response.text
+    return _finish_chat(text, query, chat_history, rel_start, rel_end, is_latest)
+
+
+async def chatbot_async(query: str, kg_df: pd.DataFrame, chat_history: list, gemini_model,
+                        stream: bool = STREAM_EXTRACTION):
+    """chatbot() for an event loop: KG hashing/caching and time parsing run concurrently off the loop."""
+    (rel_start, rel_end, is_latest), (model, prefix) = await asyncio.gather(
+        asyncio.to_thread(interpret_relative_time, query),
+        asyncio.to_thread(_kg_model, kg_df, gemini_model),
+    )
+    full_prompt = _build_prompt(query, chat_history, prefix, rel_start, rel_end, is_latest)
+
+    response = await model.generate_content_async(full_prompt, generation_config=_EXTRACT_CONFIG, stream=stream)
+    text = await _astream_text(response) if stream else response.text
+    return _finish_chat(text, query, chat_history, rel_start, rel_end, is_latest)
+
+_BATCH_PROMPT = """
+Có nhiều câu hỏi độc lập, đánh số [1]..[n].
+Trả về MỘT JSON array gồm n object theo đúng thứ tự câu hỏi, mỗi object có các khóa
+location/start_date/end_date/is_latest/devices như trên. Không giải thích.
+"""
+
+
+def chatbot_batch(queries: list, kg_df: pd.DataFrame, gemini_model) -> list:
+    """
+    Resolve several independent queries (no chat history) in ONE Gemini call, paying the KG prefill once.
+    Returns one result dict per query, in order; None where the model gave nothing usable.
+    """
+    if not queries:
+        return []
+    rels = [interpret_relative_time(q) for q in queries]
+    model, prefix = _kg_model(kg_df, gemini_model)
+
+    lines = []
+    for i, (q, (rel_start, rel_end, is_latest)) in enumerate(zip(queries, rels), 1):
+        hint = f" (TimeHint: Requested: {rel_start} to {rel_end}, Latest: {is_latest})" if rel_start else ""
+        lines.append(f"[{i}] {q}{hint}")
+    full_prompt = f"{prefix}{_BATCH_PROMPT}\n" + "\n".join(lines) + "\nJSON:"
+
+    config = genai.GenerationConfig(temperature=0.0, max_output_tokens=min(800 * len(queries), 8192))
+    response = model.generate_content(full_prompt, generation_config=config)
+    content = _strip_fences(response.text)
+
+    try:
+        items = orjson.loads(content)
+    except orjson.JSONDecodeError:
+        snippet = _extract_json(content, "[", "]")
+        if not snippet:
+            return [None] * len(queries)
+        items = orjson.loads(snippet)
+    if not isinstance(items, list):
+        items = [items]
+
+    items = (items + [None] * len(queries))[:len(queries)]
+    return [_enrich_result(r, *rel) if isinstance(r, dict) else None for r, rel in zip(items, rels)]
+
 
 def analyze_data(fetched_data_list, original_query, gemini_model):
     """Gửi TẤT CẢ dữ liệu tóm tắt đến Gemini trong MỘT lần gọi duy nhất."""
     if not fetched_data_list:
         return "Không có dữ liệu để phân tích."
 
+    items = [item for item in fetched_data_list
+             if not item['data'].empty and 'value' in item['data'].columns]
     stats_list = []
-    for item in fetched_data_list:
-        df = item['data']
-        label = item['label']
-
-        if df.empty or 'value' not in df.columns:
-            continue
-
-        stats = {
-            "ten_bien": label,
-            "so_luong_diem_du_lieu": len(df),
-            "gia_tri_trung_binh": round(df['value'].mean(), 2),
-            "gia_tri_thap_nhat": round(df['value'].min(), 2),
-            "gia_tri_cao_nhat": round(df['value'].max(), 2),
-            "ngay_bat_dau_du_lieu": df['ts'].min().strftime("%Y-%m-%d"),
-            "ngay_ket_thuc_du_lieu": df['ts'].max().strftime("%Y-%m-%d")
-        }
-        stats_list.append(stats)
+    if items:
+        # One groupby over all series; keyed by position so repeated labels stay separate
+        big = pd.concat([item['data'][['ts', 'value']].assign(_i=i) for i, item in enumerate(items)],
+                        ignore_index=True, copy=False)
+        agg = big.groupby('_i', sort=False).agg(
+            n=('value', 'size'), mean=('value', 'mean'), lo=('value', 'min'), hi=('value', 'max'),
+            ts_lo=('ts', 'min'), ts_hi=('ts', 'max'),
+        )
+        for i, n, mean, lo, hi, ts_lo, ts_hi in agg.itertuples(name=None):
+            stats_list.append({
+                "ten_bien": items[i]['label'],
+                "so_luong_diem_du_lieu": int(n),
+                "gia_tri_trung_binh": round(float(mean), 2),
+                "gia_tri_thap_nhat": round(float(lo), 2),
+                "gia_tri_cao_nhat": round(float(hi), 2),
+                "ngay_bat_dau_du_lieu": ts_lo.strftime("%Y-%m-%d"),
+                "ngay_ket_thuc_du_lieu": ts_hi.strftime("%Y-%m-%d")
+            })
 
     if not stats_list:
         return "Không có dữ liệu hợp lệ nào được tìm thấy để phân tích."
@@ -314,7 +540,7 @@ def analyze_data(fetched_data_list, original_query, gemini_model):
     Bạn là một kỹ sư phân tích dữ liệu. Người dùng vừa xem biểu đồ cho câu hỏi: "{original_query}"
 
     Dưới đây là một DANH SÁCH các số liệu thống kê tóm tắt cho các biến:
-    {json.dumps(stats_list, ensure_ascii=False, indent=2)}
+    {_dumps_indent(stats_list)}
 
     Hãy đưa ra phân tích chuyên môn 2-3 câu bằng tiếng Việt cho TỪNG BIẾN trong danh sách.
     Tập trung vào: giá trị trung bình, xu hướng, và các điểm bất thường (giá trị cao nhất/thấp nhất so với trung bình).
@@ -11,13 +11,18 @@ Original file is located at
 import os
 import re
 import json
-import requests
+import orjson
+import time
+import base64
+import httpx
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
+from concurrent.futures import ThreadPoolExecutor
 import difflib
+from rapidfuzz import process, fuzz
 
 # ================================================================
 # ⚙️ CONFIG / AUTH
@@ -27,6 +32,7 @@ load_dotenv()
 TB_USER = os.getenv("TB_USER", "USER")
 TB_PASS = os.getenv("TB_PASS", "PASS")
 BASE_URL = os.getenv("BASE_URL") or "https://newsense.viphap.com/api"
+TOKEN_CACHE_PATH = ".newsense_token.json"
 
 # ================================================================
 # 🧠 STATE GLOBALS
@@ -173,19 +179,36 @@ def ensure_lookups(kg_df_input):
 # ================================================================
 # 🕓 INTERPRET RELATIVE TIME (giữ nguyên từ bản gốc, đã tốt)
 # ================================================================
+_REL_PAT = re.compile(r"(\d+)\s*(ngày|tuần|tháng|năm)")
+_KEYWORDS = re.compile(r"(hôm nay|hôm qua|tuần này|tháng này|từ đầu năm|năm ngoái)")
+_ISO_DATE_PAT = re.compile(r"\d{4}-\d{2}-\d{2}")
+_VN_DATE_PAT = re.compile(r"\d{1,2}/\d{1,2}/\d{4}")
+
+# keyword -> now -> (start, end), in the order the keywords are checked
+_KEYWORD_RANGES = {
+    "hôm nay":    lambda now: (now, now),
+    "hôm qua":    lambda now: (now - timedelta(days=1), now - timedelta(days=1)),
+    "tuần này":   lambda now: (now - timedelta(days=now.weekday()), now),
+    "tháng này":  lambda now: (now.replace(day=1), now),
+    "từ đầu năm": lambda now: (now.replace(month=1, day=1), now),
+    "năm ngoái":  lambda now: (datetime(now.year - 1, 1, 1), datetime(now.year - 1, 12, 31)),
+}
+# Những từ này được ưu tiên hơn cụm "N ngày/tuần/tháng/năm"
+_PRIORITY_KEYWORDS = ("hôm nay", "hôm qua")
+
 def interpret_relative_time(query: str):
     now = datetime.now()
     text = query.lower()
 
-    if "hôm nay" in text:
-        start = now.replace(hour=0, minute=0, second=0)
-        return start.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
-
-    if "hôm qua" in text:
-        yesterday = now - timedelta(days=1)
-        return yesterday.strftime("%Y-%m-%d"), yesterday.strftime("%Y-%m-%d")
+    kw = None
+    if _KEYWORDS.search(text):
+        # Several keywords may appear; the first in check order wins, not the leftmost in the text
+        kw = next(k for k in _KEYWORD_RANGES if k in text)
+    if kw in _PRIORITY_KEYWORDS:
+        start, end = _KEYWORD_RANGES[kw](now)
+        return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
 
-    m = re.search(r"(\d+)\s*(ngày|tuần|tháng|năm)", text)
+    m = _REL_PAT.search(text)
     if m:
         n, unit = int(m.group(1)), m.group(2)
         if unit == "ngày":   start = now - timedelta(days=n)
@@ -194,29 +217,19 @@ def interpret_relative_time(query: str):
         elif unit == "năm":  start = datetime(now.year - n + 1, 1, 1)
         return start.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
 
-    if "tuần này" in text:
-        start = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0)
-        return start.strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
-
-    if "tháng này" in text:
-        return now.replace(day=1).strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
-
-    if "từ đầu năm" in text:
-        return now.replace(month=1, day=1).strftime("%Y-%m-%d"), now.strftime("%Y-%m-%d")
-
-    if "năm ngoái" in text:
-        y = now.year - 1
-        return f"{y}-01-01", f"{y}-12-31"
+    if kw:
+        start, end = _KEYWORD_RANGES[kw](now)
+        return start.strftime("%Y-%m-%d"), end.strftime("%Y-%m-%d")
 
     # Ngày tuyệt đối dạng YYYY-MM-DD
-    dates = re.findall(r"\d{4}-\d{2}-\d{2}", text)
+    dates = _ISO_DATE_PAT.findall(text)
     if len(dates) >= 2:
         return dates[0], dates[1]
     if len(dates) == 1:
         return dates[0], now.strftime("%Y-%m-%d")
 
     # Ngày dạng DD/MM/YYYY
-    dates2 = re.findall(r"\d{1,2}/\d{1,2}/\d{4}", text)
+    dates2 = _VN_DATE_PAT.findall(text)
     if dates2:
         parsed = [datetime.strptime(d, "%d/%m/%Y").strftime("%Y-%m-%d") for d in dates2]
         return (parsed[0], parsed[1]) if len(parsed) >= 2 else (parsed[0], now.strftime("%Y-%m-%d"))
@@ -266,6 +279,7 @@ def extract_data_types(text: str) -> list[str]:
             for word in words:
                 if difflib.SequenceMatcher(None, word, dt).ratio() > 0.85:
                     found_patterns.add(dt)
+                    break
 
     # 3. Khớp chính xác tên biến (nếu người dùng gõ thẳng tên biến)
     for keyword, var_name in exact_var_map.items():
@@ -480,6 +494,23 @@ def trend_description(df: pd.DataFrame) -> str:
     stability = "biến động cao" if cv > 30 else ("biến động vừa" if cv > 10 else "ổn định")
     return f"{trend}, {stability} (CV={cv:.1f}%)"
 
+def _series_stats(df: pd.DataFrame) -> dict:
+    """n / mean / min / max / latest and peak times of a telemetry frame, straight on the numpy arrays."""
+    v  = df["value"].to_numpy()
+    ts = df["ts"].to_numpy()
+    i_max, i_min, i_last = v.argmax(), v.argmin(), ts.argmax()
+    return {
+        "n":         len(v),
+        "mean":      v.mean(dtype=np.float64),
+        "min":       v[i_min],
+        "max":       v[i_max],
+        # Newsense may return points newest-first, so the latest point is the max-ts one
+        "latest":    v[i_last],
+        "latest_ts": pd.Timestamp(ts[i_last]).strftime('%Y-%m-%d %H:%M:%S'),
+        "max_ts":    pd.Timestamp(ts[i_max]).strftime('%Y-%m-%d %H:%M'),
+        "min_ts":    pd.Timestamp(ts[i_min]).strftime('%Y-%m-%d %H:%M'),
+    }
+
 def analyze_data_offline(fetched_data_list: list, original_query: str):
     """
     🔑 Phân tích thống kê + phát hiện bất thường + mô tả xu hướng + Lấy giá trị mới nhất.
@@ -504,16 +535,7 @@ def analyze_data_offline(fetched_data_list: list, original_query: str):
             print("   ℹ️  Không có dữ liệu.")
             continue
 
-        mean_val = df["value"].mean()
-        min_val  = df["value"].min()
-        max_val  = df["value"].max()
-        std_val  = df["value"].std()
-        n        = len(df)
-
-        # --- LẤY GIÁ TRỊ MỚI NHẤT Ở ĐÂY ---
-        latest_row = df.iloc[-1]
-        latest_val = latest_row["value"]
-        latest_ts = latest_row["ts"].strftime('%Y-%m-%d %H:%M:%S')
+        stats = _series_stats(df)
 
         # Tìm unit từ THRESHOLDS
         unit = ""
@@ -523,17 +545,15 @@ def analyze_data_offline(fetched_data_list: list, original_query: str):
                 break
 
         # Thống kê cơ bản
-        print(f"   🟢 MỚI NHẤT       : {latest_val:.3f} {unit} (Cập nhật lúc {latest_ts})")
-        print(f"   📊 Số điểm dữ liệu: {n}")
-        print(f"   📈 Cao nhất       : {max_val:.3f} {unit}")
-        print(f"   📉 Thấp nhất      : {min_val:.3f} {unit}")
-        print(f"   〰️  Trung bình     : {mean_val:.3f} {unit}")
+        print(f"   🟢 MỚI NHẤT       : {stats['latest']:.3f} {unit} (Cập nhật lúc {stats['latest_ts']})")
+        print(f"   📊 Số điểm dữ liệu: {stats['n']}")
+        print(f"   📈 Cao nhất       : {stats['max']:.3f} {unit}")
+        print(f"   📉 Thấp nhất      : {stats['min']:.3f} {unit}")
+        print(f"   〰️  Trung bình     : {stats['mean']:.3f} {unit}")
 
         # Thời gian đỉnh
-        idx_max = df["value"].idxmax()
-        idx_min = df["value"].idxmin()
-        print(f"   🕐 Đỉnh cao nhất lúc: {df.loc[idx_max, 'ts'].strftime('%Y-%m-%d %H:%M')}")
-        print(f"   🕐 Đỉnh thấp nhất lúc: {df.loc[idx_min, 'ts'].strftime('%Y-%m-%d %H:%M')}")
+        print(f"   🕐 Đỉnh cao nhất lúc: {stats['max_ts']}")
+        print(f"   🕐 Đỉnh thấp nhất lúc: {stats['min_ts']}")
 
         # Xu hướng
         trend = trend_description(df)
@@ -553,41 +573,129 @@ def analyze_data_offline(fetched_data_list: list, original_query: str):
 # ================================================================
 # 🛑 NEWSENSE CLIENT (giữ nguyên từ bản gốc)
 # ================================================================
+def _as_float(value):
+    """float(value), or NaN for missing/non-numeric telemetry values."""
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return np.nan
+
+def _parse_json(content):
+    """orjson.loads, falling back to stdlib json for payloads with NaN/Infinity literals."""
+    try:
+        return orjson.loads(content)
+    except orjson.JSONDecodeError:
+        return json.loads(content)
+
+def _jwt_expiry(token):
+    """Read the `exp` claim (epoch seconds) from a JWT without verifying it."""
+    try:
+        payload = token.split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return orjson.loads(base64.urlsafe_b64decode(payload)).get("exp", 0)
+    except (AttributeError, IndexError, ValueError):
+        return 0
+
 class NewsenseClient:
-    def __init__(self, base_url, username, password):
+    def __init__(self, base_url, username, password, token_cache_path=TOKEN_CACHE_PATH):
         self.base_url = base_url.rstrip('/')
         self.username = username
         self.password = password
-        self.token = self.login()
+        self.token_cache_path = token_cache_path
+        # httpx decodes gzip transparently; HTTP/2 multiplexes requests over one connection
+        self.session = httpx.Client(http2=True, timeout=30.0, headers={"Accept-Encoding": "gzip, deflate"})
+        self.token = self._load_cached_token() or self.refresh_token()
+        self.session.headers["X-Authorization"] = f"Bearer {self.token}"
 
     def login(self):
-        resp = requests.post(f"{self.base_url}/auth/login",
-                             json={"username": self.username, "password": self.password})
+        resp = self.session.post(f"{self.base_url}/auth/login",
+                                 json={"username": self.username, "password": self.password})
         if resp.status_code == 401:
             raise Exception("❌ Sai username hoặc mật khẩu.")
         resp.raise_for_status()
         print("✅ Đăng nhập Newsense thành công.")
-        return resp.json().get("token")
+        return orjson.loads(resp.content).get("token")
+
+    def refresh_token(self):
+        self.token = self.login()
+        self.session.headers["X-Authorization"] = f"Bearer {self.token}"
+        self._save_cached_token()
+        return self.token
+
+    def _load_cached_token(self):
+        try:
+            with open(self.token_cache_path, 'rb') as f:
+                cached = orjson.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if cached.get("base_url") != self.base_url or cached.get("username") != self.username:
+            return None
+        # Leave a minute of margin so a request doesn't race the expiry
+        if cached.get("exp", 0) <= time.time() + 60:
+            return None
+        return cached.get("token")
+
+    def _save_cached_token(self):
+        cached = {"base_url": self.base_url, "username": self.username,
+                  "token": self.token, "exp": _jwt_expiry(self.token)}
+        tmp_path = self.token_cache_path + ".tmp"
+        try:
+            # Bearer token: owner-only, whatever the umask
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(orjson.dumps(cached))
+            os.chmod(tmp_path, 0o600)  # O_CREAT's mode doesn't apply to a leftover tmp file
+            os.replace(tmp_path, self.token_cache_path)
+        except OSError as e:
+            print(f"⚠️ Không lưu được token: {e}")
+
+    def _get(self, url, **kwargs):
+        """GET on the session, logging in again once if the token is rejected."""
+        token = self.token
+        resp = self.session.get(url, **kwargs)
+        if resp.status_code == 401:
+            # Another caller may already have refreshed it
+            if self.token == token:
+                self.refresh_token()
+            resp = self.session.get(url, **kwargs)
+        return resp
+
+    async def _aget(self, http, url, **kwargs):
+        """Async _get over a client from async_session()."""
+        token = self.token
+        resp = await http.get(url, **kwargs)
+        if resp.status_code == 401:
+            if self.token == token:
+                self.refresh_token()
+            http.headers["X-Authorization"] = f"Bearer {self.token}"
+            resp = await http.get(url, **kwargs)
+        return resp
+
+    def _get_devices_page(self, page):
+        resp = self._get(f"{self.base_url}/tenant/devices", params={"pageSize": 100, "page": page})
+        resp.raise_for_status()
+        return _parse_json(resp.content)
 
     def get_devices(self):
-        headers = {"X-Authorization": f"Bearer {self.token}"}
-        page, devices = 0, []
-        while True:
-            resp = requests.get(f"{self.base_url}/tenant/devices", headers=headers,
-                                params={"pageSize": 100, "page": page})
-            resp.raise_for_status()
-            data = resp.json()
+        # Page 0 tells us how many pages there are; fetch the rest concurrently
+        pages = [self._get_devices_page(0)]
+        total_pages = pages[0].get("totalPages", 1)
+        if total_pages > 1:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                pages.extend(executor.map(self._get_devices_page, range(1, total_pages)))
+
+        devices = []
+        for data in pages:
             for d in data.get("data", []):
                 devices.append({"id": d["id"]["id"], "name": d["name"]})
-            if not data.get("hasNextPage"):
-                break
-            page += 1
         return devices
 
-    def get_timeseries(self, device_id, key, start_date_str, end_date_str):
-        headers = {"X-Authorization": f"Bearer {self.token}"}
-        url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+    def async_session(self):
+        """Pooled HTTP/2 client for one batch of concurrent requests (use with `async with`)."""
+        return httpx.AsyncClient(http2=True, timeout=30.0, limits=httpx.Limits(max_connections=50),
+                                 headers=self.session.headers)
 
+    def _timeseries_params(self, key, start_date_str, end_date_str):
         try:
             start_dt = datetime.strptime(start_date_str, "%Y-%m-%d").replace(hour=0, minute=0, second=0)
             end_dt   = datetime.strptime(end_date_str,   "%Y-%m-%d").replace(hour=23, minute=59, second=59)
@@ -595,7 +703,7 @@ class NewsenseClient:
             end_ts   = int(end_dt.timestamp()   * 1000)
         except ValueError:
             print("❌ Định dạng ngày không hợp lệ.")
-            return pd.DataFrame()
+            return None
 
         duration_days = (end_dt - start_dt).days
         params = {"startTs": start_ts, "endTs": end_ts, "keys": key}
@@ -609,63 +717,119 @@ class NewsenseClient:
         else:
             params["limit"] = 10000
             print(f"   - Dữ liệu thô cho {key}")
+        return params
 
-        resp = requests.get(url, headers=headers, params=params)
+    @staticmethod
+    def _timeseries_frame(data):
+        if not data:
+            return pd.DataFrame()
+
+        ts_field = "timestamp" if "timestamp" in data[0] else "ts"
+        ts  = np.fromiter((d[ts_field] for d in data), dtype=np.int64, count=len(data))
+        val = np.fromiter((_as_float(d.get("value")) for d in data), dtype=np.float64, count=len(data))
+        mask = ~np.isnan(val)
+        ts, val = ts[mask], val[mask]
+        # float32 is plenty for sensor readings and halves what each cached series holds
+        df = pd.DataFrame({"ts": pd.to_datetime(ts, unit="ms"), "value": val.astype(np.float32)})
+        if len(val):
+            # Newsense may return points newest-first, so take the max-ts point
+            df.attrs["latest"] = float(val[ts.argmax()])
+        return df
+
+    def get_timeseries(self, device_id, key, start_date_str, end_date_str):
+        return self.get_timeseries_multi(device_id, [key], start_date_str, end_date_str)[key]
+
+    def get_timeseries_multi(self, device_id, keys, start_date_str, end_date_str):
+        """Fetch several keys of one device in a single request. Returns {key: DataFrame}."""
+        keys = list(dict.fromkeys(keys))
+        url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+        params = self._timeseries_params(",".join(keys), start_date_str, end_date_str)
+        if params is None:
+            return {k: pd.DataFrame() for k in keys}
+
+        resp = self._get(url, params=params)
         if resp.status_code != 200:
             print(f"⚠️ HTTP {resp.status_code}: {resp.text[:200]}")
-            return pd.DataFrame()
+            return {k: pd.DataFrame() for k in keys}
+        data = _parse_json(resp.content)
+        return {k: self._timeseries_frame(data.get(k, [])) for k in keys}
+
+    async def aget_timeseries(self, http, device_id, key, start_date_str, end_date_str):
+        """Async get_timeseries over a client from async_session()."""
+        frames = await self.aget_timeseries_multi(http, device_id, [key], start_date_str, end_date_str)
+        return frames[key]
+
+    async def aget_timeseries_multi(self, http, device_id, keys, start_date_str, end_date_str):
+        """Async get_timeseries_multi over a client from async_session()."""
+        keys = list(dict.fromkeys(keys))
+        url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/values/timeseries"
+        params = self._timeseries_params(",".join(keys), start_date_str, end_date_str)
+        if params is None:
+            return {k: pd.DataFrame() for k in keys}
 
-        data = resp.json().get(key, [])
-        if not data:
-            return pd.DataFrame()
+        resp = await self._aget(http, url, params=params)
+        if resp.status_code != 200:
+            print(f"⚠️ HTTP {resp.status_code}: {resp.text[:200]}")
+            return {k: pd.DataFrame() for k in keys}
+        data = _parse_json(resp.content)
+        return {k: self._timeseries_frame(data.get(k, [])) for k in keys}
 
-        df = pd.DataFrame(data)
-        try:
-            df["ts"] = pd.to_datetime(df["timestamp"], unit="ms")
-        except:
-            df["ts"] = pd.to_datetime(df["ts"], unit ="ms")
-        df["value"] = pd.to_numeric(df["value"], errors="coerce")
-        return df[["ts", "value"]].dropna(subset=["value"])
+    @staticmethod
+    def _latest_rows(data, device_name, keys, time_delay_seconds):
+        results = []
+        now = datetime.now(timezone.utc)
+
+        for key in keys:
+            if key in data and len(data[key]) > 0:
+                last_ts = data[key][0]['ts']
+                last_time = datetime.fromtimestamp(last_ts / 1000, tz=timezone.utc)
+                diff = now - last_time
+
+                status = "🟢 Active" if diff.total_seconds() < time_delay_seconds else "🔴 Stopped"
+
+                results.append({
+                    "Device Name": device_name,
+                    "Variable (Key)": key,
+                    "Last Update": last_time.astimezone().strftime('%Y-%m-%d %H:%M:%S'),
+                    "Delay": f"{diff.days}d {diff.seconds//3600}h {(diff.seconds%3600)//60}m",
+                    "Status": status
+                })
+            else:
+                results.append({
+                    "Device Name": device_name,
+                    "Variable (Key)": key,
+                    "Last Update": "Never",
+                    "Delay": "N/A",
+                    "Status": "⚪ No Data"
+                })
+        return results
 
     def get_latest_telemetry(self, device_id, device_name, keys, time_delay_seconds=3600):
         if not keys: return []
 
-        headers = {"X-Authorization": f"Bearer {self.token}"}
         keys_str = ",".join(keys)
         url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys={keys_str}&limit=1"
 
-        results = []
         try:
-            resp = requests.get(url, headers=headers)
-            data = resp.json()
-            now = datetime.now(timezone.utc)
-
-            for key in keys:
-                if key in data and len(data[key]) > 0:
-                    last_ts = data[key][0]['ts']
-                    last_time = datetime.fromtimestamp(last_ts / 1000, tz=timezone.utc)
-                    diff = now - last_time
-
-                    status = "🟢 Active" if diff.total_seconds() < time_delay_seconds else "🔴 Stopped"
-
-                    results.append({
-                        "Device Name": device_name,
-                        "Variable (Key)": key,
-                        "Last Update": last_time.astimezone().strftime('%Y-%m-%d %H:%M:%S'),
-                        "Delay": f"{diff.days}d {diff.seconds//3600}h {(diff.seconds%3600)//60}m",
-                        "Status": status
-                    })
-                else:
-                    results.append({
-                        "Device Name": device_name,
-                        "Variable (Key)": key,
-                        "Last Update": "Never",
-                        "Delay": "N/A",
-                        "Status": "⚪ No Data"
-                    })
+            resp = self._get(url)
+            return self._latest_rows(_parse_json(resp.content), device_name, keys, time_delay_seconds)
         except Exception as e:
             print(f"⚠️ Lỗi khi quét {device_name}: {e}")
-        return results
+        return []
+
+    async def aget_latest_telemetry(self, http, device_id, device_name, keys, time_delay_seconds=3600):
+        """Async get_latest_telemetry over a client from async_session()."""
+        if not keys: return []
+
+        keys_str = ",".join(keys)
+        url = f"{self.base_url}/plugins/telemetry/DEVICE/{device_id}/values/timeseries?keys={keys_str}&limit=1"
+
+        try:
+            resp = await self._aget(http, url)
+            return self._latest_rows(_parse_json(resp.content), device_name, keys, time_delay_seconds)
+        except Exception as e:
+            print(f"⚠️ Lỗi khi quét {device_name}: {e}")
+        return []
 
 
 # ================================================================
@@ -682,8 +846,9 @@ def chatbot(query: str, kg_df_input: pd.DataFrame, chat_history: list):
         "is_latest": is_latest,
         "devices": parsed.get("devices", [])
     }
-    result_str = json.dumps(result, ensure_ascii=False)
-    chat_history.append({"role": "model", "content": result_str})
+    result_str = orjson.dumps(result).decode()
+    # Keep the dict alongside the JSON text so the UI doesn't re-parse it on every rerun
+    chat_history.append({"role": "model", "content": result_str, "parsed": result})
     return result_str, chat_history
 
 def analyze_data(fetched_data_list: list, original_query: str):
@@ -702,27 +867,19 @@ def analyze_data(fetched_data_list: list, original_query: str):
         if df.empty or "value" not in df.columns:
             output.append("ℹ️  Không có dữ liệu.")
             continue
-        mean_val = df["value"].mean()
-        min_val  = df["value"].min()
-        max_val  = df["value"].max()
-        n        = len(df)
-        latest_row = df.iloc[-1]
-        latest_val = latest_row["value"]
-        latest_ts = latest_row["ts"].strftime('%Y-%m-%d %H:%M:%S')
+        stats = _series_stats(df)
         unit = ""
         for k, v in THRESHOLDS.items():
             if k in key_lower:
                 unit = v["unit"]
                 break
-        output.append(f"🟢 MỚI NHẤT       : {latest_val:.3f} {unit} (Cập nhật lúc {latest_ts})")
-        output.append(f"📊 Số điểm dữ liệu: {n}")
-        output.append(f"📈 Cao nhất       : {max_val:.3f} {unit}")
-        output.append(f"📉 Thấp nhất      : {min_val:.3f} {unit}")
-        output.append(f"〰️  Trung bình     : {mean_val:.3f} {unit}")
-        idx_max = df["value"].idxmax()
-        idx_min = df["value"].idxmin()
-        output.append(f"🕐 Đỉnh cao nhất lúc: {df.loc[idx_max, 'ts'].strftime('%Y-%m-%d %H:%M')}")
-        output.append(f"🕐 Đỉnh thấp nhất lúc: {df.loc[idx_min, 'ts'].strftime('%Y-%m-%d %H:%M')}")
+        output.append(f"🟢 MỚI NHẤT       : {stats['latest']:.3f} {unit} (Cập nhật lúc {stats['latest_ts']})")
+        output.append(f"📊 Số điểm dữ liệu: {stats['n']}")
+        output.append(f"📈 Cao nhất       : {stats['max']:.3f} {unit}")
+        output.append(f"📉 Thấp nhất      : {stats['min']:.3f} {unit}")
+        output.append(f"〰️  Trung bình     : {stats['mean']:.3f} {unit}")
+        output.append(f"🕐 Đỉnh cao nhất lúc: {stats['max_ts']}")
+        output.append(f"🕐 Đỉnh thấp nhất lúc: {stats['min_ts']}")
         trend = trend_description(df)
         output.append(f"📡 Xu hướng       : {trend}")
         alerts = detect_anomalies(df, key_lower)
@@ -743,11 +900,13 @@ if __name__ == "__main__":
         client = NewsenseClient(BASE_URL, TB_USER, TB_PASS)
         all_devices = client.get_devices()
         device_name_to_id_map = {d["name"]: d["id"] for d in all_devices}
+        device_keys = list(device_name_to_id_map)
         print(f"✅ Đã tải {len(device_name_to_id_map)} thiết bị từ Newsense.")
     except Exception as e:
         print(f"❌ Không thể khởi tạo Newsense Client: {e}")
         client = None
         device_name_to_id_map = {}
+        device_keys = []
 
     print("\n🤖 Chatbot Offline sẵn sàng. Gõ 'exit' để thoát.")
     print("💡 Ví dụ: 'GNSS 3 ngày gần đây'\n")
@@ -771,7 +930,7 @@ if __name__ == "__main__":
             result = parse_query_offline(query)
 
             print("\n🧠 Kết quả phân tích (Offline):")
-            print(json.dumps(result, ensure_ascii=False, indent=2))
+            print(orjson.dumps(result, option=orjson.OPT_INDENT_2).decode())
 
             devices_to_plot = result.get("devices", [])
             start_date      = result.get("start_date")
@@ -800,10 +959,10 @@ if __name__ == "__main__":
 
                 device_id = device_name_to_id_map.get(device_name)
                 if not device_id:
-                    matches = difflib.get_close_matches(device_name, device_name_to_id_map.keys(), n=1, cutoff=0.8)
-                    if matches:
-                        print(f"   - Fuzzy match: '{device_name}' → '{matches[0]}'")
-                        device_id = device_name_to_id_map[matches[0]]
+                    match = process.extractOne(device_name, device_keys, scorer=fuzz.ratio, score_cutoff=80)
+                    if match:
+                        print(f"   - Fuzzy match: '{device_name}' → '{match[0]}'")
+                        device_id = device_name_to_id_map[match[0]]
                     else:
                         print(f"   - ⚠️ Không tìm thấy: '{device_name}'")
                         continue